@@ -12,4 +12,7 @@ docker build -t message-broker -f src/approach_b_message_broker/Dockerfile .
 echo "Building spark-processing image..."
 docker build -t spark-processing -f src/approach_c_spark_processing/Dockerfile .
 
+echo "Building numba-processing image..."
+docker build -t numba-processing -f src/approach_d_numba/Dockerfile .
+
 echo "All images built successfully."
\ No newline at end of file
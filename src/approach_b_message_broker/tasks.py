@@ -1,6 +1,9 @@
 from celery import Celery
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+from numba import njit
+import os
 
 app = Celery('tasks')
 app.config_from_object('celeryconfig')
@@ -11,47 +14,142 @@ THRESHOLDS = {
     "pressao": (940, 1060)
 }
 
-def detectar_anomalias(df):
-    for sensor in ["temperatura", "umidade", "pressao"]:
-        min_val, max_val = THRESHOLDS[sensor]
-        df[f"{sensor}_anormal"] = ~df[sensor].between(min_val, max_val)
-    return df
+SENSORES = list(THRESHOLDS)
+LIMITE_INFERIOR = np.array([THRESHOLDS[s][0] for s in SENSORES])
+LIMITE_SUPERIOR = np.array([THRESHOLDS[s][1] for s in SENSORES])
 
-@app.task
-def calcular_percentual_anomalias(estacao_csv):
-    df = pd.read_json(estacao_csv)
-    id_est = str(df["id_estacao"].iloc[0])
-    resultados = []
-    for sensor in ["temperatura", "umidade", "pressao"]:
-        total = len(df)
-        anomalias = (~df[sensor].between(*THRESHOLDS[sensor])).sum()
-        resultados.append({
+JANELA_NS = 10 * 60 * 10**9  # janela de 10 minutos em nanossegundos
+
+# Com CELERY_DEBUG=1 as tarefas conferem a ordem cronológica enviada pelo producer
+DEBUG = os.environ.get("CELERY_DEBUG", "0") == "1"
+
+@njit(cache=True)
+def detectar_anomalias_kernel(valores, limite_inferior, limite_superior, anormais):
+    # Sem prange: cada processo do worker já ocupa um núcleo
+    for s in range(valores.shape[1]):
+        inferior, superior = limite_inferior[s], limite_superior[s]
+        for i in range(valores.shape[0]):
+            anormais[i, s] = not (inferior <= valores[i, s] <= superior)
+
+def mascara_anomalias(df):
+    # Mesmo layout (ordem F) do bloco de sensores do pandas
+    valores = df[SENSORES].to_numpy()
+    anormais = np.empty(valores.shape, dtype=np.bool_, order="F")
+    detectar_anomalias_kernel(valores, LIMITE_INFERIOR, LIMITE_SUPERIOR, anormais)
+    return anormais
+
+def le_grupo(payload):
+    # Reconstrói o DataFrame a partir do buffer Arrow IPC enviado pelo producer
+    return pa.ipc.open_stream(payload).read_all().to_pandas()
+
+def ordem_por_grupo(codigos, timestamps, n_grupos):
+    """Ordem que agrupa as linhas por código de grupo sem perder a ordem cronológica, com os limites de cada grupo nela."""
+    # Estável: mantém a ordem cronológica enviada pelo producer
+    ordem = np.argsort(codigos, kind="stable")
+    codigos = codigos[ordem]
+    if DEBUG:
+        assert ((np.diff(timestamps[ordem]) >= 0) | (np.diff(codigos) != 0)).all()
+    limites = np.searchsorted(codigos, np.arange(n_grupos + 1))
+    return ordem, limites
+
+@njit(cache=True)
+def contar_multianomalias(timestamps, anormais, limites, janela_ns):
+    # Janela deslizante (t - 10min, t] com dois índices; as somas recomeçam a cada estação
+    n_sensores = anormais.shape[1]
+    totais = np.zeros(limites.shape[0] - 1, dtype=np.int64)
+    for g in range(limites.shape[0] - 1):
+        comeco, final = limites[g], limites[g + 1]
+        somas = np.zeros(n_sensores, dtype=np.int64)
+        inicio = comeco
+        for fim in range(comeco, final):
+            for s in range(n_sensores):
+                somas[s] += anormais[fim, s]
+            while timestamps[inicio] <= timestamps[fim] - janela_ns:
+                for s in range(n_sensores):
+                    somas[s] -= anormais[inicio, s]
+                inicio += 1
+            sensores_anormais = 0
+            for s in range(n_sensores):
+                if somas[s] > 0:
+                    sensores_anormais += 1
+            if sensores_anormais > 1:
+                totais[g] += 1
+    return totais
+
+def calcular_estacoes(df, anormais):
+    """Percentual de anomalias por sensor e períodos de coocorrência de todas as estações do lote."""
+    estacoes = df["id_estacao"].cat
+    timestamps = df["timestamp"].to_numpy("datetime64[ns]").view("i8")
+    ordem, limites = ordem_por_grupo(estacoes.codes.to_numpy(), timestamps, len(estacoes.categories))
+    timestamps = timestamps[ordem]
+    anormais = anormais.view(np.uint8)[ordem]
+    presentes = np.flatnonzero(limites[:-1] < limites[1:])
+    # Uma redução por faixa contígua de estação, sem as faixas vazias
+    totais = np.add.reduceat(anormais, limites[presentes], axis=0, dtype=np.int64)
+    percentuais = 100 * totais / np.diff(limites)[presentes, None]
+    periodos = contar_multianomalias(timestamps, anormais, limites, JANELA_NS)
+    anomalias = []
+    coocorrencias = []
+    for linha, g in enumerate(presentes):
+        id_est = str(estacoes.categories[g])
+        for s, sensor in enumerate(SENSORES):
+            anomalias.append({
+                "id_estacao": id_est,
+                "sensor": sensor,
+                "percentual_anomalias": float(percentuais[linha, s])
+            })
+        coocorrencias.append({
             "id_estacao": id_est,
-            "sensor": sensor,
-            "percentual_anomalias": float(100 * anomalias / total)
+            "periodos_multianomalias_10min": int(periodos[g])
         })
-    return resultados
+    return anomalias, coocorrencias
 
-@app.task
-def calcular_periodos_coocorrencia(estacao_csv):
-    df = pd.read_json(estacao_csv)
-    df = detectar_anomalias(df)
-    df = df.sort_values("timestamp").set_index("timestamp")
-    grupo = df[["temperatura_anormal", "umidade_anormal", "pressao_anormal"]]
-    rolling = grupo.rolling("10min").sum()
-    mask = (rolling > 0).sum(axis=1) > 1
+@njit(cache=True)
+def media_movel_janela(timestamps, valores, limites, janela_ns):
+    # Mesma janela do contar_multianomalias; as somas recomeçam a cada região
+    n_linhas, n_sensores = valores.shape
+    medias = np.empty((n_linhas, n_sensores))
+    for g in range(limites.shape[0] - 1):
+        comeco, final = limites[g], limites[g + 1]
+        somas = np.zeros(n_sensores)
+        inicio = comeco
+        for fim in range(comeco, final):
+            for s in range(n_sensores):
+                somas[s] += valores[fim, s]
+            while timestamps[inicio] <= timestamps[fim] - janela_ns:
+                for s in range(n_sensores):
+                    somas[s] -= valores[inicio, s]
+                inicio += 1
+            for s in range(n_sensores):
+                medias[fim, s] = somas[s] / (fim - inicio + 1)
+    return medias
+
+def calcular_media_movel(df, anormais):
+    """Média móvel de 10min das leituras normais de todas as regiões do lote, numa única chamada ao kernel."""
+    # Só os índices das linhas normais, sem filtrar o DataFrame inteiro
+    normais = np.flatnonzero(~anormais.any(axis=1))
+    regioes = df["regiao"].cat
+    timestamps = df["timestamp"].to_numpy("datetime64[ns]")[normais]
+    ordem, limites = ordem_por_grupo(regioes.codes.to_numpy()[normais], timestamps.view("i8"), len(regioes.categories))
+    linhas = normais[ordem]
+    timestamps = timestamps[ordem]
+    valores = df[SENSORES].to_numpy()[linhas].astype(np.float64)
+    medias = media_movel_janela(timestamps.view("i8"), valores, limites, JANELA_NS)
+    # Colunas em vez de um dict por linha
     return {
-        "id_estacao": str(df["id_estacao"].iloc[0]),
-        "periodos_multianomalias_10min": int(mask.sum())
+        **{sensor: medias[:, s] for s, sensor in enumerate(SENSORES)},
+        "regiao": pd.Categorical.from_codes(np.repeat(np.arange(len(limites) - 1), np.diff(limites)), categories=regioes.categories),
+        "timestamp": timestamps,
     }
 
+# Cada tarefa processa um lote de estações (ou regiões), não um único grupo
+@app.task
+def calcular_estacoes_lote(lote_ipc):
+    df = le_grupo(lote_ipc)
+    anomalias, coocorrencias = calcular_estacoes(df, mascara_anomalias(df))
+    return {"anomalias": anomalias, "coocorrencias": coocorrencias}
+
 @app.task
-def calcular_media_movel(regiao_csv):
-    df = pd.read_json(regiao_csv)
-    df = detectar_anomalias(df)
-    df = df.sort_values("timestamp").set_index("timestamp")
-    df = df[~(df["temperatura_anormal"] | df["umidade_anormal"] | df["pressao_anormal"])]
-    rolling = df[["temperatura", "umidade", "pressao"]].rolling("10min").mean()
-    rolling["regiao"] = df["regiao"].iloc[0]
-    rolling["timestamp"] = rolling.index
-    return rolling.reset_index(drop=True).to_dict(orient="records")
+def calcular_media_movel_lote(lote_ipc):
+    df = le_grupo(lote_ipc)
+    return calcular_media_movel(df, mascara_anomalias(df))
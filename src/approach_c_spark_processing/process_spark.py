@@ -1,9 +1,11 @@
 from pyspark.sql import SparkSession
-from pyspark.sql.functions import col, avg, window, countDistinct
+from pyspark.sql.types import StructType, StructField, TimestampType, StringType, FloatType
+from pyspark.sql.functions import col, avg, floor, countDistinct, count, lit, when, sum as spark_sum
 import time
 import json
 import os
 import pandas as pd
+import numpy as np
 from pathlib import Path
 
 THRESHOLDS = {
@@ -12,31 +14,51 @@ THRESHOLDS = {
     "pressao": (940, 1060)
 }
 
+# Esquema explícito do CSV: evita a passada extra de leitura do inferSchema.
+# Sensores em float32, o que reduz pela metade os dados trocados nos shuffles
+ESQUEMA = StructType([
+    StructField("timestamp", TimestampType()),
+    StructField("id_estacao", StringType()),
+    StructField("regiao", StringType()),
+    StructField("temperatura", FloatType()),
+    StructField("umidade", FloatType()),
+    StructField("pressao", FloatType()),
+])
+
+JANELA_S = 10 * 60  # janela de 10 minutos em segundos
+
+SENSORES = list(THRESHOLDS)
+LIMITE_INFERIOR = np.array([THRESHOLDS[s][0] for s in SENSORES])
+LIMITE_SUPERIOR = np.array([THRESHOLDS[s][1] for s in SENSORES])
+
+def mascara_anomalias(df):
+    valores = df[SENSORES].to_numpy(copy=False)
+    return ~((valores >= LIMITE_INFERIOR) & (valores <= LIMITE_SUPERIOR))
+
 def detectar_anomalias(df):
-    for sensor in ["temperatura", "umidade", "pressao"]:
-        min_val, max_val = THRESHOLDS[sensor]
-        df[f"{sensor}_anormal"] = ~df[sensor].between(min_val, max_val)
+    df[[f"{sensor}_anormal" for sensor in SENSORES]] = mascara_anomalias(df)
     return df
 
 def validar_corretude(df_processado):
     gabarito_path = Path("data/anomalias_reais.csv")
     if not gabarito_path.exists(): return None
     gabarito_df = pd.read_csv(gabarito_path, parse_dates=["timestamp"])
-    detectadas_df = df_processado.melt(
-        id_vars=["timestamp", "id_estacao"],
-        value_vars=["temperatura_anormal", "umidade_anormal", "pressao_anormal"],
-        var_name="sensor_anomalo",
-        value_name="is_anormal"
-    )
-    detectadas_df = detectadas_df[detectadas_df["is_anormal"]]
-    detectadas_df["sensor_anomalo"] = detectadas_df["sensor_anomalo"].str.replace("_anormal", "")
-    merged_df = pd.merge(
-        gabarito_df, detectadas_df,
-        on=["timestamp", "id_estacao", "sensor_anomalo"],
-        how='outer', indicator=True
-    )
+    timestamps = df_processado["timestamp"].to_numpy("datetime64[ns]")
+    estacoes = df_processado["id_estacao"].to_numpy()
+    chaves = [[], [], []]
+    for sensor in SENSORES:
+        idx = np.flatnonzero(df_processado[f"{sensor}_anormal"].to_numpy())
+        chaves[0].append(timestamps[idx])
+        chaves[1].append(estacoes[idx])
+        chaves[2].append(np.full(len(idx), sensor, dtype=object))
+    detectadas = pd.MultiIndex.from_arrays([np.concatenate(chave) for chave in chaves])
+    gabarito = pd.MultiIndex.from_arrays([
+        gabarito_df["timestamp"].to_numpy("datetime64[ns]"),
+        gabarito_df["id_estacao"].to_numpy(),
+        gabarito_df["sensor_anomalo"].to_numpy(),
+    ])
     return {
-        "verdadeiros_positivos": len(merged_df[merged_df['_merge'] == 'both']),
+        "verdadeiros_positivos": int(gabarito.isin(detectadas).sum()),
     }
 
 def main():
@@ -44,30 +66,56 @@ def main():
     
     output_path = "data/tempo_execucao.json"
     
+    # AQE junta as partições pequenas depois de cada shuffle: as agregações por estação,
+    # janela e região não disparam as 200 tarefas quase vazias do padrão
     spark = SparkSession.builder \
         .appName("MeteorologicalSparkProcessing") \
         .config("spark.default.parallelism", spark_parallelism) \
+        .config("spark.sql.adaptive.enabled", "true") \
+        .config("spark.sql.adaptive.coalescePartitions.enabled", "true") \
         .getOrCreate()
 
     start = time.perf_counter()
     
-    df = spark.read.csv("/app/data/dados_meteorologicos.csv", header=True, inferSchema=True)
-    df = df.withColumn("timestamp", col("timestamp").cast("timestamp"))
+    df = spark.read.schema(ESQUEMA).csv("/app/data/dados_meteorologicos.csv", header=True)
 
     # Anomalias
     for sensor, (min_val, max_val) in THRESHOLDS.items():
         df = df.withColumn(f"{sensor}_anormal", ~((col(sensor) >= min_val) & (col(sensor) <= max_val)))
+    # Marca uma única vez as leituras com algum sensor anômalo
+    df = df.withColumn("any_anormal", col("temperatura_anormal") | col("umidade_anormal") | col("pressao_anormal"))
+    # Janela de 10min como um long (segundos desde a época // 600), alinhada como a do window()
+    df = df.withColumn("janela", floor(col("timestamp").cast("long") / JANELA_S))
+
+    # Métricas 1 e 3 agrupam por estação a partir das mesmas colunas de anomalia: uma única
+    # agregação por (estação, janela de 10min) sobre o DataFrame grande alimenta as duas
+    multianomalias = df.withColumn("soma_anomalias",
+        col("temperatura_anormal").cast("int") +
+        col("umidade_anormal").cast("int") +
+        col("pressao_anormal").cast("int")
+    )
+    por_janela = multianomalias.groupBy("id_estacao", "janela").agg(
+        count("*").alias("total"),
+        *[spark_sum(col(f"{sensor}_anormal").cast("int")).alias(sensor) for sensor in THRESHOLDS],
+        # countDistinct ignora nulos: conta só os timestamps com mais de um sensor anômalo
+        countDistinct(when(col("soma_anomalias") > 1, col("timestamp"))).alias("eventos")
+    )
 
     # Métrica 1: Percentual de anomalias por estação e sensor
-    anomalias = []
-    for sensor in THRESHOLDS:
-        total = df.groupBy("id_estacao").count().withColumnRenamed("count", "total")
-        anom = df.filter(col(f"{sensor}_anormal")).groupBy("id_estacao").count().withColumnRenamed("count", "anom")
-        joined = total.join(anom, "id_estacao", "left").fillna(0)
-        final = joined.withColumn("sensor", col("id_estacao") * 0 + sensor)\
-                      .withColumn("percentual_anomalias", (col("anom") / col("total")) * 100)\
-                      .select("id_estacao", "sensor", "percentual_anomalias")
-        anomalias.append(final)
+    # As janelas são disjuntas, então somá-las por estação dá o total e as anomalias de cada sensor;
+    # cada sensor vira só uma projeção dessa tabela pequena, sem join nem novo groupBy
+    contagens = por_janela.groupBy("id_estacao").agg(
+        spark_sum("total").alias("total"),
+        *[spark_sum(sensor).alias(sensor) for sensor in THRESHOLDS]
+    )
+    anomalias = [
+        contagens.select(
+            "id_estacao",
+            lit(sensor).alias("sensor"),
+            ((col(sensor) / col("total")) * 100).alias("percentual_anomalias")
+        )
+        for sensor in THRESHOLDS
+    ]
 
     df_anomalias = anomalias[0]
     for extra in anomalias[1:]:
@@ -76,32 +124,21 @@ def main():
     # df_anomalias.coalesce(1).write.csv("/app/output/percentuais_anomalias", header=True, mode="overwrite")
 
     # Métrica 2: Média móvel de 10min por região (sem anomalias)
-    clean_df = df.filter(~col("temperatura_anormal") & ~col("umidade_anormal") & ~col("pressao_anormal"))
+    clean_df = df.filter(~col("any_anormal"))
 
-    moving_avg = clean_df.groupBy(
-        window("timestamp", "10 minutes"),
-        "regiao"
-    ).agg(
+    moving_avg = clean_df.groupBy("janela", "regiao").agg(
         avg("temperatura").alias("media_temperatura"),
         avg("umidade").alias("media_umidade"),
         avg("pressao").alias("media_pressao")
     )
 
     # moving_avg.selectExpr(
-    #     "window.start as inicio_janela", "window.end as fim_janela", "regiao",
+    #     "cast(janela * 600 as timestamp) as inicio_janela", "cast((janela + 1) * 600 as timestamp) as fim_janela", "regiao",
     #     "media_temperatura", "media_umidade", "media_pressao"
     # ).coalesce(1).write.csv("/app/output/media_movel_regiao", header=True, mode="overwrite")
 
     # Métrica 3: Períodos com múltiplos sensores anômalos em 10min por estação
-    multianomalias = df.withColumn("soma_anomalias",
-        col("temperatura_anormal").cast("int") +
-        col("umidade_anormal").cast("int") +
-        col("pressao_anormal").cast("int")
-    )
-
-    cooc = multianomalias.filter(col("soma_anomalias") > 1)\
-        .groupBy("id_estacao", window("timestamp", "10 minutes"))\
-        .agg(countDistinct("timestamp").alias("eventos"))
+    cooc = por_janela.filter(col("eventos") > 0).select("id_estacao", "janela", "eventos")
 
     # cooc.groupBy("id_estacao").count()\
     #     .withColumnRenamed("count", "periodos_multianomalias_10min")\
@@ -111,12 +148,16 @@ def main():
     duration_ms = (end - start) * 1000
     
     # Carrega novamente o CSV original em pandas para análise de corretude
-    df_pandas = pd.read_csv("data/dados_meteorologicos.csv", parse_dates=["timestamp"])
+    df_pandas = pd.read_csv(
+        "data/dados_meteorologicos.csv",
+        parse_dates=["timestamp"],
+        dtype={sensor: "float32" for sensor in SENSORES},
+    )
     df_pandas = detectar_anomalias(df_pandas)
     corretude_results = validar_corretude(df_pandas)
     
     final_results = {"tempo": duration_ms, "corretude": corretude_results}
-    with open("data/tempo_execucao.json", "w") as f:
+    with open(output_path, "w") as f:
         json.dump(final_results, f)
         
     os.chmod(output_path, 0o666)
@@ -1,6 +1,9 @@
 # > python src/data_generator.py 12 60 0.02
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
 from pathlib import Path
 import time
 
@@ -21,42 +24,76 @@ def generate_data(num_stations: int, num_events_per_station: int, anomaly_percen
     print(f"Iniciando geração de dados para {num_stations} estações com {num_events_per_station} eventos cada...")
     total_events = num_stations * num_events_per_station
     
-    #  Pré-alocação de Arrays com NumPy 
     regions_list = ["Sudeste", "Nordeste", "Sul", "Norte", "Centro-Oeste"]
-    all_timestamps = np.empty(total_events, dtype='datetime64[s]')
-    all_station_ids = np.empty(total_events, dtype=object)
-    all_regions = np.empty(total_events, dtype=object)
-    all_temperatures = np.empty(total_events, dtype=float)
-    all_humidities = np.empty(total_events, dtype=float)
-    all_pressures = np.empty(total_events, dtype=float)
-
-    # Preenchimento em Lotes
-    timestamps_base = pd.to_datetime(np.arange(num_events_per_station), unit='m', origin=pd.Timestamp(start_date_str)).to_numpy()
-    
-    for i in range(num_stations):
-        start_idx = i * num_events_per_station
-        end_idx = (i + 1) * num_events_per_station
-        
-        station_id = f"STA-{i+1:03d}"
-        region = regions_list[i % len(regions_list)]
-        
-        # Preenche as colunas de identificação
-        all_timestamps[start_idx:end_idx] = timestamps_base
-        all_station_ids[start_idx:end_idx] = station_id
-        all_regions[start_idx:end_idx] = region
-
-        # Gera dados numéricos de forma vetorizada
-        time_component = np.linspace(0, 2 * np.pi, num_events_per_station)
-        region_offset = i * 0.5
+    rng = np.random.default_rng()
+
+    # Cada estação ocupa um bloco contíguo de eventos; estação e região são categóricas
+    station_codes = np.repeat(np.arange(num_stations), num_events_per_station)
+    all_station_ids = pd.Categorical.from_codes(station_codes, categories=[f"STA-{i+1:03d}" for i in range(num_stations)])
+    all_regions = pd.Categorical.from_codes(station_codes % len(regions_list), categories=regions_list)
+    # Um evento por minuto a partir da data inicial, repetido para cada estação
+    timestamps_base = np.datetime64(start_date_str, 's') + np.arange(num_events_per_station) * np.timedelta64(1, 'm')
+    all_timestamps = np.tile(timestamps_base, num_stations)
+
+    # Gera os dados numéricos de todas as estações de uma vez, como matrizes (estações, eventos)
+    time_component = np.linspace(0, 2 * np.pi, num_events_per_station, dtype=np.float32)
+    sin_t = np.sin(time_component)
+    region_offset = (np.arange(num_stations, dtype=np.float32) * 0.5)[:, None]
+    shape = (num_stations, num_events_per_station)
+
+    all_temperatures, all_humidities, all_pressures = (np.empty(total_events, dtype=np.float32) for _ in range(3))
+
+    temp_base = 25 + 8 * sin_t + region_offset
+    temperatures = all_temperatures.reshape(shape)
+    rng.standard_normal(dtype=np.float32, out=temperatures)
+    temperatures *= 0.5
+    temperatures += temp_base
+
+    humidity_base = 60 - 20 * sin_t
+    humidities = all_humidities.reshape(shape)
+    rng.standard_normal(dtype=np.float32, out=humidities)
+    humidities *= 2
+    humidities += humidity_base
+    np.clip(humidities, 0, 100, out=humidities)
+
+    pressure_base = 1012 + 5 * np.sin(time_component / 2)
+    pressures = all_pressures.reshape(shape)
+    rng.standard_normal(dtype=np.float32, out=pressures)
+    pressures += pressure_base
+
+    # Injeção de anomalias de forma vetorizada, direto nos arrays NumPy
+    print("Introduzindo anomalias...")
+    num_anomalies = int(total_events * anomaly_percentage)
+    sensor_arrays = {"temperatura": all_temperatures, "umidade": all_humidities, "pressao": all_pressures}
+    if num_anomalies > 0:
+        anomaly_indices = rng.choice(total_events, size=num_anomalies, replace=False)
+        sensors = np.array(["temperatura", "umidade", "pressao"])
+        sensor_codes = rng.integers(0, len(sensors), size=num_anomalies)
+        signs = rng.integers(0, 2, size=num_anomalies) * 2 - 1
+        anomaly_values = np.empty(num_anomalies, dtype=np.float32)
         
-        temp_base = 25 + 8 * np.sin(time_component) + region_offset
-        all_temperatures[start_idx:end_idx] = temp_base + np.random.normal(0, 0.5, num_events_per_station)
-
-        humidity_base = 60 - 20 * np.sin(time_component)
-        all_humidities[start_idx:end_idx] = np.clip(humidity_base + np.random.normal(0, 2, num_events_per_station), 0, 100)
-
-        pressure_base = 1012 + 5 * np.sin(time_component / 2)
-        all_pressures[start_idx:end_idx] = pressure_base + np.random.normal(0, 1, num_events_per_station)
+        for code, sensor in enumerate(sensors):
+            # Posições (entre as anomalias) que alteram este sensor específico
+            sensor_mask = (sensor_codes == code)
+            if sensor_mask.any():
+                values = sensor_arrays[sensor]
+                # Estatísticas acumuladas em float64, mesmo com os valores em float32
+                mean = values.mean(dtype=np.float64)
+                std_dev = values.std(ddof=1, dtype=np.float64)  # mesmo desvio amostral do Series.std()
+                
+                # Gera todos os valores anômalos para este sensor de uma vez e aplica no array do sensor
+                anomaly_values[sensor_mask] = mean + signs[sensor_mask] * 5 * std_dev
+                values[anomaly_indices[sensor_mask]] = anomaly_values[sensor_mask]
+
+        # Gabarito montado de uma vez a partir dos arrays, sem um DataFrame por sensor nem concat
+        anomalies_df = pd.DataFrame({
+            "timestamp": all_timestamps[anomaly_indices],
+            "id_estacao": all_station_ids[anomaly_indices],
+            "sensor_anomalo": sensors[sensor_codes],
+            "valor_anomalo": anomaly_values,
+        })
+    else:
+        anomalies_df = pd.DataFrame()
 
     # Criação de um único DataFrame
     print("Construindo DataFrame final...")
@@ -69,41 +106,6 @@ def generate_data(num_stations: int, num_events_per_station: int, anomaly_percen
         "pressao": all_pressures
     })
 
-    # Injeção de anomalias de forma vetorizada
-    print("Introduzindo anomalias...")
-    num_anomalies = int(total_events * anomaly_percentage)
-    if num_anomalies > 0:
-        anomaly_indices = np.random.choice(final_df.index, size=num_anomalies, replace=False)
-        sensors = ["temperatura", "umidade", "pressao"]
-        sensors_to_alter = np.random.choice(sensors, size=num_anomalies)
-        
-        ground_truth_anomalies = []
-        
-        for sensor in sensors:
-            # Pega os índices que terão anomalia neste sensor específico
-            sensor_mask = (sensors_to_alter == sensor)
-            indices_for_sensor = anomaly_indices[sensor_mask]
-            
-            if len(indices_for_sensor) > 0:
-                mean = final_df[sensor].mean()
-                std_dev = final_df[sensor].std()
-                
-                # Gera todos os valores anômalos para este sensor de uma vez
-                anomaly_values = mean + np.random.choice([-1, 1], size=len(indices_for_sensor)) * 5 * std_dev
-                
-                # Aplica as anomalias no DataFrame de forma vetorizada
-                final_df.loc[indices_for_sensor, sensor] = anomaly_values
-                
-                # Guarda os registros para o gabarito
-                anomalies_info = final_df.loc[indices_for_sensor, ['timestamp', 'id_estacao']]
-                anomalies_info['sensor_anomalo'] = sensor
-                anomalies_info['valor_anomalo'] = anomaly_values
-                ground_truth_anomalies.append(anomalies_info)
-        
-        anomalies_df = pd.concat(ground_truth_anomalies)
-    else:
-        anomalies_df = pd.DataFrame()
-
     print(f"Geração de dados concluída. Total de {len(final_df)} registros e {len(anomalies_df)} anomalias geradas.")
     return final_df, anomalies_df   
 
@@ -151,19 +153,24 @@ if __name__ == "__main__":
     output_dir = Path("data")
     output_dir.mkdir(parents=True, exist_ok=True)
 
-    # Salva os DataFrames em arquivos CSV
-    print("Salvando arquivos CSV...")
+    # Salva os DataFrames em arquivos CSV, e os dados também em Parquet (comprimido com zstd).
+    # Os dois saem da mesma tabela Arrow, pelos writers em C++ do Arrow em vez do to_csv do pandas
+    print("Salvando arquivos CSV e Parquet...")
     start_time = time.perf_counter()
     data_path = output_dir / "dados_meteorologicos.csv"
+    parquet_path = output_dir / "dados_meteorologicos.parquet"
     anomalies_path = output_dir / "anomalias_reais.csv"
     
-    dados_gerados.to_csv(data_path, index=False)
+    opcoes_csv = pacsv.WriteOptions(quoting_style="none")
+    tabela_dados = pa.Table.from_pandas(dados_gerados, preserve_index=False)
+    pacsv.write_csv(tabela_dados, data_path, write_options=opcoes_csv)
+    pq.write_table(tabela_dados, parquet_path, compression="zstd")
     if not anomalias_reais.empty:
-        anomalias_reais.to_csv(anomalies_path, index=False)
+        pacsv.write_csv(pa.Table.from_pandas(anomalias_reais, preserve_index=False), anomalies_path, write_options=opcoes_csv)
     end_time = time.perf_counter()
     print(f"Tempo de escrita dos dados: {end_time - start_time:.4f} segundos")
 
     total_gerado = args.num_estacoes * args.eventos_por_estacao
     print(f"\n{total_gerado} eventos foram gerados e salvos em:")
-    print(f"  - Dados: {data_path}")
+    print(f"  - Dados: {data_path} e {parquet_path}")
     print(f"  - Anomalias de referência: {anomalies_path}")
\ No newline at end of file